@@ -5,16 +5,21 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, OperationFailure
 from datetime import datetime, timezone
+import logging
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import List, Mapping, Optional, Sequence, Tuple, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 _client = None
 db = None
 
@@ -22,34 +27,140 @@ database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    _client = AsyncIOMotorClient(database_url)
     db = _client[database_name]
 
-# Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
-    """Insert a single document with timestamp"""
-    if db is None:
-        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+def _search_text(product: dict):
+    """Lowercased title and tags in one field, so prefix search is a single
+    case-sensitive anchored regex over one index"""
+    return [(product.get('title') or '').lower()] + [t.lower() for t in product.get('tags') or []]
 
+def _prepare_document(collection_name: str, data: Union[BaseModel, Mapping], now: datetime):
+    """Copy data into an insertable dict with timestamps and derived fields"""
     # Convert Pydantic model to dict if needed
     if isinstance(data, BaseModel):
         data_dict = data.model_dump()
     else:
         data_dict = data.copy()
 
-    data_dict['created_at'] = datetime.now(timezone.utc)
-    data_dict['updated_at'] = datetime.now(timezone.utc)
+    data_dict['created_at'] = now
+    data_dict['updated_at'] = now
+
+    if collection_name == "product":
+        data_dict['search_text'] = _search_text(data_dict)
 
-    result = db[collection_name].insert_one(data_dict)
+    return data_dict
+
+# Helper functions for common database operations
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
+    """Insert a single document with timestamp"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    data_dict = _prepare_document(collection_name, data, datetime.now(timezone.utc))
+
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
-    """Get documents from collection"""
+INSERT_BATCH_SIZE = 1000
+DUPLICATE_KEY = 11000
+
+async def create_many_documents(collection_name: str, data: Sequence[Union[BaseModel, Mapping]]):
+    """Insert several documents with timestamps in as few round trips as possible.
+    Returns the ids that were inserted; documents rejected as duplicate keys
+    are skipped rather than failing the whole call."""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    now = datetime.now(timezone.utc)
+    docs = [_prepare_document(collection_name, item, now) for item in data]
+
+    # Unordered so a single duplicate doesn't abort the rest of the batch
+    inserted_ids = []
+    for start in range(0, len(docs), INSERT_BATCH_SIZE):
+        batch = docs[start:start + INSERT_BATCH_SIZE]
+        try:
+            result = await db[collection_name].insert_many(batch, ordered=False)
+            inserted_ids.extend(str(_id) for _id in result.inserted_ids)
+        except BulkWriteError as e:
+            # Only duplicate keys are skipped; any other write error, or a
+            # write concern failure, means the inserts can't be trusted
+            write_errors = e.details.get("writeErrors", [])
+            if e.details.get("writeConcernErrors") or any(err.get("code") != DUPLICATE_KEY for err in write_errors):
+                raise
+            # insert_many assigns _id to every document up front; keep those
+            # that weren't duplicates
+            duplicates = {err["index"] for err in write_errors}
+            inserted_ids.extend(str(doc["_id"]) for i, doc in enumerate(batch) if i not in duplicates)
+    return inserted_ids
+
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None, projection: dict = None, sort: Optional[List[Tuple[str, int]]] = None):
+    """Get documents from collection, optionally restricted to the projected fields"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
     
-    cursor = db[collection_name].find(filter_dict or {})
+    cursor = db[collection_name].find(filter_dict or {}, projection)
+    if sort:
+        cursor = cursor.sort(sort)
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=limit or None)
+
+async def aggregate_documents(collection_name: str, pipeline: List[dict]):
+    """Run an aggregation pipeline and return the resulting documents"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    return await db[collection_name].aggregate(pipeline).to_list(length=None)
+
+INDEXES = [
+    # Full-text index backing the `q` search on products
+    ("product", [("title", "text"), ("tags", "text")], {"name": "product_text"}),
+    # Prefix search on products
+    ("product", "search_text", {"name": "search_text"}),
+    # Category equality first, price range last (ESR)
+    ("product", [("category", 1), ("price", 1)], {"name": "cat_price"}),
+    # Paginated listings sort on _id: equality, sort, then range
+    ("product", [("category", 1), ("_id", 1), ("price", 1)], {"name": "cat_id_price"}),
+    ("product", "slug", {"name": "slug_unique", "unique": True}),
+    ("order", [("status", 1), ("_id", -1)], {"name": "status_recent"}),
+]
+
+async def _backfill_search_text():
+    """Add search_text to products inserted before the field existed.
+    Computed in Python with _search_text, not $toLower (ASCII-only), so
+    backfilled and newly inserted products lowercase the same way."""
+    updates = []
+    async for product in db.product.find({"search_text": {"$exists": False}}, {"title": 1, "tags": 1}):
+        updates.append(UpdateOne({"_id": product["_id"]}, {"$set": {"search_text": _search_text(product)}}))
+        if len(updates) == INSERT_BATCH_SIZE:
+            await db.product.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        await db.product.bulk_write(updates, ordered=False)
+
+async def ensure_indexes():
+    """Create the indexes the API queries rely on (no-op if they already exist)
+    and backfill derived fields on older documents"""
+    if db is None:
+        return
+
+    # An index the server rejects (e.g. a conflicting existing index or
+    # duplicate legacy slugs) doesn't skip the rest, but an unreachable server
+    # stops everything rather than timing out once per step
+    try:
+        for collection_name, keys, options in INDEXES:
+            try:
+                await db[collection_name].create_index(keys, **options)
+            except OperationFailure:
+                logger.exception("Failed to create index %s on %s", options["name"], collection_name)
+
+        # One-time migration; a no-op once every product has search_text
+        try:
+            await _backfill_search_text()
+        except OperationFailure:
+            logger.exception("Failed to backfill product search_text")
+    except ConnectionFailure:
+        logger.exception("Database unreachable; skipped index creation")
+
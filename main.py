@@ -1,18 +1,81 @@
 import os
-from fastapi import FastAPI, HTTPException
+import asyncio
+import math
+import re
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import ORJSONResponse
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.decorator import cache
+from redis import asyncio as aioredis
+from pydantic import BaseModel, Field, ValidationError
+from types import MappingProxyType
+from typing import Any, List, Mapping, Optional, Tuple
+from bson import ObjectId
+from bson.errors import InvalidId
+from bson.regex import Regex
 
-from database import db, create_document, get_documents
+from database import db, create_document, create_many_documents, get_documents, aggregate_documents, ensure_indexes
 
-app = FastAPI(title="Newtonbotics Lab Store API", version="0.1.0")
+# Product listings change rarely; entries expire on their own in case an
+# invalidation is missed.
+PRODUCTS_CACHE_NAMESPACE = "products"
+PRODUCTS_CACHE_TTL = 300
+
+# Flat shipping fee charged on every order
+SHIPPING_FEE = float(os.getenv("SHIPPING_FEE", "0"))
+
+MAX_PAGE_SIZE = 100
+
+# Fields needed to render a product card; the detail endpoint returns the rest
+LIST_PROJECTION = {
+    "title": 1,
+    "slug": 1,
+    "price": 1,
+    "category": 1,
+    "in_stock": 1,
+    "images": {"$slice": 1},
+    "tags": 1,
+}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Built in the background so a slow or unreachable database can't hold
+    # up startup; failures are logged by ensure_indexes itself
+    index_task = asyncio.create_task(ensure_indexes())
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        FastAPICache.init(RedisBackend(aioredis.from_url(redis_url)), prefix="lab")
+    else:
+        FastAPICache.init(InMemoryBackend(), prefix="lab")
+    yield
+    index_task.cancel()
+
+
+app = FastAPI(
+    title="Newtonbotics Lab Store API",
+    version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
+
+# Comma-separated list, e.g. "https://shop.example.com,http://localhost:3000".
+# Without it any origin is allowed, but credentials are not (the spec
+# forbids combining them with a wildcard).
+ALLOWED_ORIGINS = [o.strip() for o in os.getenv("ALLOWED_ORIGINS", "").split(",") if o.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
+    allow_origins=ALLOWED_ORIGINS or ["*"],
+    allow_credentials=bool(ALLOWED_ORIGINS),
+    allow_methods=["GET", "POST"],
     allow_headers=["*"],
 )
 
@@ -22,8 +85,21 @@ def read_root():
     return {"message": "Newtonbotics Lab Store Backend Running"}
 
 
+# /test may be polled as a healthcheck; only the ping runs on every hit
+COLLECTIONS_CACHE_TTL = 60
+_COLLECTIONS_CACHE = {"at": float("-inf"), "names": []}  # -inf: first hit always refreshes
+
+
+async def _collection_names() -> List[str]:
+    now = time.monotonic()
+    if now - _COLLECTIONS_CACHE["at"] > COLLECTIONS_CACHE_TTL:
+        _COLLECTIONS_CACHE["names"] = (await db.list_collection_names())[:10]
+        _COLLECTIONS_CACHE["at"] = now
+    return _COLLECTIONS_CACHE["names"]
+
+
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -38,7 +114,8 @@ def test_database():
             response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
             response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
             try:
-                response["collections"] = db.list_collection_names()[:10]
+                await db.command("ping")
+                response["collections"] = await _collection_names()
                 response["database"] = "✅ Connected & Working"
                 response["connection_status"] = "Connected"
             except Exception as e:
@@ -59,105 +136,132 @@ class ProductQuery(BaseModel):
     limit: int = 30
 
 
+def _with_id(doc: dict) -> dict:
+    """Copy of a Mongo document with its ObjectId `_id` exposed as string `id`"""
+    return {"id": str(doc["_id"]), **{k: v for k, v in doc.items() if k != "_id"}}
+
+
+@lru_cache(maxsize=256)
+def _search_filter(q: str, prefix: bool) -> dict:
+    """Filter clause for the `q` search, built once per distinct (q, prefix).
+    Callers merge it into their own filter and must not mutate it."""
+    if prefix:
+        # Search-as-you-type: an anchored, case-sensitive pattern over the
+        # lowercased search_text field is bounded by its index
+        return {"search_text": Regex(f"^{re.escape(q.lower())}")}
+    # Full-text search on title/tags (served by the "product_text" index)
+    return {"$text": {"$search": q}}
+
+
 @app.get("/api/products")
-def list_products(q: Optional[str] = None, category: Optional[str] = None, min_price: Optional[float] = None, max_price: Optional[float] = None, limit: int = 30):
-    """Query products by text, category, and price range"""
+@cache(expire=PRODUCTS_CACHE_TTL, namespace=PRODUCTS_CACHE_NAMESPACE)
+async def list_products(q: Optional[str] = None, category: Optional[str] = None, min_price: Optional[float] = None, max_price: Optional[float] = None, limit: int = Query(30, ge=1, le=MAX_PAGE_SIZE), prefix: bool = False, after: Optional[str] = None):
+    """Query products by text (or title/tag prefix), category, and price range.
+    Pages are keyed on id: pass the previous response's `next` as `after`."""
     filter_dict = {}
+    if after:
+        try:
+            filter_dict["_id"] = {"$gt": ObjectId(after)}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
     if category:
         filter_dict["category"] = category
-    if min_price is not None or max_price is not None:
-        price_filter = {}
-        if min_price is not None:
-            price_filter["$gte"] = min_price
-        if max_price is not None:
-            price_filter["$lte"] = max_price
+    price_filter = {op: v for op, v in (("$gte", min_price), ("$lte", max_price)) if v is not None}
+    if price_filter:
         filter_dict["price"] = price_filter
-    # Simple text search on title/tags if q provided
     if q:
-        filter_dict["$or"] = [
-            {"title": {"$regex": q, "$options": "i"}},
-            {"tags": {"$elemMatch": {"$regex": q, "$options": "i"}}},
-        ]
+        filter_dict.update(_search_filter(q, prefix))
     try:
-        products = get_documents("product", filter_dict, limit=limit)
-        # Convert ObjectId to string if present
-        for p in products:
-            if "_id" in p:
-                p["id"] = str(p.pop("_id"))
-        return {"items": products}
+        products = await get_documents("product", filter_dict, limit=limit, projection=LIST_PROJECTION, sort=[("_id", 1)])
+        items = [_with_id(p) for p in products]
+        return {"items": items, "next": items[-1]["id"] if len(items) == limit else None}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Minimal sample data for /api/products/sample-seed. Read-only at the top
+# level and tuples for lists; the nested specs stay plain dicts because BSON
+# can't encode mapping proxies and inserts only copy the top level.
+SAMPLES: Tuple[Mapping[str, Any], ...] = (
+    MappingProxyType({
+        "title": "Precision Servo Mount",
+        "slug": "precision-servo-mount",
+        "description": "CNC-accurate 3D-printed mount for standard servos with M3 hardware.",
+        "category": "3d-printed",
+        "price": 9.99,
+        "in_stock": True,
+        "images": ("/products/servo-mount-1.jpg",),
+        "tags": ("mount", "3d print", "servo"),
+        "specs": {
+            "dimensions_mm": "40x20x18",
+            "materials": ("PLA+",),
+            "tolerance_mm": 0.2,
+            "mounting_pattern": "M3 16mm",
+        },
+    }),
+    MappingProxyType({
+        "title": "Laser-Engraved Control Panel Plate",
+        "slug": "control-panel-plate",
+        "description": "Acrylic front panel with crisp vector engravings and pre-drilled holes.",
+        "category": "laser-engraved",
+        "price": 24.0,
+        "in_stock": True,
+        "images": ("/products/panel-plate-1.jpg",),
+        "tags": ("panel", "acrylic", "engraved"),
+        "specs": {
+            "dimensions_mm": "120x60x3",
+            "materials": ("Acrylic",),
+        },
+    }),
+    MappingProxyType({
+        "title": "Robotics Power Distribution Board",
+        "slug": "pdb-12v",
+        "description": "12V PDB with fused outputs, screw terminals, and status LEDs.",
+        "category": "electronics",
+        "price": 39.5,
+        "in_stock": True,
+        "images": ("/products/pdb-12v-1.jpg",),
+        "tags": ("pdb", "12v", "electronics"),
+        "specs": {
+            "voltage_range_v": "9-14V",
+            "current_max_a": 10.0,
+        },
+    }),
+)
+
+
 @app.get("/api/products/sample-seed")
-def seed_sample_products():
+async def seed_sample_products():
     """Seed database with a small set of demo products if empty.
     Returns count of inserted documents."""
     try:
-        existing = get_documents("product", {}, limit=1)
+        existing = await get_documents("product", {}, limit=1, projection={"_id": 1})
         if existing:
             return {"inserted": 0, "message": "Products already exist"}
-        # Minimal sample data
-        samples = [
-            {
-                "title": "Precision Servo Mount",
-                "slug": "precision-servo-mount",
-                "description": "CNC-accurate 3D-printed mount for standard servos with M3 hardware.",
-                "category": "3d-printed",
-                "price": 9.99,
-                "in_stock": True,
-                "images": ["/products/servo-mount-1.jpg"],
-                "tags": ["mount", "3d print", "servo"],
-                "specs": {
-                    "dimensions_mm": "40x20x18",
-                    "materials": ["PLA+"],
-                    "tolerance_mm": 0.2,
-                    "mounting_pattern": "M3 16mm",
-                },
-            },
-            {
-                "title": "Laser-Engraved Control Panel Plate",
-                "slug": "control-panel-plate",
-                "description": "Acrylic front panel with crisp vector engravings and pre-drilled holes.",
-                "category": "laser-engraved",
-                "price": 24.0,
-                "in_stock": True,
-                "images": ["/products/panel-plate-1.jpg"],
-                "tags": ["panel", "acrylic", "engraved"],
-                "specs": {
-                    "dimensions_mm": "120x60x3",
-                    "materials": ["Acrylic"],
-                },
-            },
-            {
-                "title": "Robotics Power Distribution Board",
-                "slug": "pdb-12v",
-                "description": "12V PDB with fused outputs, screw terminals, and status LEDs.",
-                "category": "electronics",
-                "price": 39.5,
-                "in_stock": True,
-                "images": ["/products/pdb-12v-1.jpg"],
-                "tags": ["pdb", "12v", "electronics"],
-                "specs": {
-                    "voltage_range_v": "9-14V",
-                    "current_max_a": 10.0,
-                },
-            },
-        ]
-        inserted = 0
-        for s in samples:
-            create_document("product", s)
-            inserted += 1
-        return {"inserted": inserted}
+        # create_many_documents copies each sample, so SAMPLES is never mutated
+        ids = await create_many_documents("product", SAMPLES)
+        # Drop cached listings so the new products show up immediately
+        await FastAPICache.clear(namespace=PRODUCTS_CACHE_NAMESPACE)
+        return {"inserted": len(ids)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/products/{slug}")
+async def get_product(slug: str):
+    """Fetch a single product with all of its fields"""
+    try:
+        products = await get_documents("product", {"slug": slug}, limit=1, projection={"search_text": 0})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if not products:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return _with_id(products[0])
 
 
 class OrderItem(BaseModel):
     product_id: str
-    title: str
-    price: float
-    quantity: int
+    quantity: int = Field(..., ge=1)
 
 
 class CustomerInfo(BaseModel):
@@ -176,24 +280,109 @@ class OrderPayload(BaseModel):
     items: List[OrderItem]
     customer: CustomerInfo
     notes: Optional[str] = None
-    subtotal: float
-    shipping: float
-    total: float
+    # Subtotal the client displayed; if sent, it must match the catalog prices
+    subtotal: Optional[float] = None
+
+
+# create_order reads the raw body, so FastAPI can't document it on its own;
+# the models are registered under components/schemas by _openapi() below
+_order_payload_schema = OrderPayload.model_json_schema(ref_template="#/components/schemas/{model}")
+ORDER_BODY_COMPONENTS = {**_order_payload_schema.pop("$defs", {}), "OrderPayload": _order_payload_schema}
 
 
-@app.post("/api/orders")
-def create_order(payload: OrderPayload):
-    """Create a Pay-on-Delivery order and return an order reference."""
+def _body_error(err: dict) -> dict:
+    """Pydantic error reshaped like FastAPI's own request body errors"""
+    err = {**err, "loc": ("body", *err["loc"])}
+    # Malformed JSON is reported with the raw body bytes as input; the 422
+    # handler can only encode them if they are valid UTF-8
+    if isinstance(err.get("input"), bytes):
+        try:
+            err["input"] = err["input"].decode()
+        except UnicodeDecodeError:
+            del err["input"]
+    return err
+
+
+@app.post(
+    "/api/orders",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": {"$ref": "#/components/schemas/OrderPayload"}}},
+        },
+    },
+)
+async def create_order(request: Request):
+    """Create a Pay-on-Delivery order and return an order reference.
+    Prices and totals are computed from the product catalog, not the client."""
+    # Validate the raw body in one pass instead of json.loads + model validation
+    try:
+        payload = OrderPayload.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError([_body_error(err) for err in e.errors(include_url=False)])
     if not payload.items:
         raise HTTPException(status_code=400, detail="Order must contain at least one item")
-    order_doc = payload.model_dump()
+    try:
+        product_ids = [ObjectId(item.product_id) for item in payload.items]
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid product id")
+
+    try:
+        # $match first so only the ordered products are read, via the _id index
+        products = await aggregate_documents("product", [
+            {"$match": {"_id": {"$in": product_ids}}},
+            {"$project": {"title": 1, "price": 1, "in_stock": 1}},
+        ])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    by_id = {p["_id"]: p for p in products}
+
+    items = []
+    for product_id, item in zip(product_ids, payload.items):
+        product = by_id.get(product_id)
+        if product is None:
+            raise HTTPException(status_code=400, detail=f"Unknown product: {item.product_id}")
+        if not product.get("in_stock", True):
+            raise HTTPException(status_code=400, detail=f"Out of stock: {product['title']}")
+        items.append({
+            "product_id": str(product_id),
+            "title": product["title"],
+            "price": product["price"],
+            "quantity": item.quantity,
+        })
+    # fsum keeps large carts free of accumulated rounding error
+    subtotal = round(math.fsum(i["price"] * i["quantity"] for i in items), 2)
+    if payload.subtotal is not None and abs(subtotal - payload.subtotal) > 0.01:
+        raise HTTPException(status_code=400, detail="subtotal mismatch")
+    total = round(subtotal + SHIPPING_FEE, 2)
+
+    # items are replaced by the priced lines, so don't serialize them
+    order_doc = payload.model_dump(exclude={"items"})
+    order_doc["items"] = items
+    order_doc["subtotal"] = subtotal
+    order_doc["shipping"] = SHIPPING_FEE
+    order_doc["total"] = total
     order_doc["payment_method"] = "cod"
     order_doc["status"] = "received"
+    # Awaited so "received" is only reported once the order is stored. The
+    # driver generates a time-ordered ObjectId _id in-process, which keeps the
+    # status_recent index newest-first.
     try:
-        order_id = create_document("order", order_doc)
-        return {"order_id": order_id, "status": "received"}
+        order_id = await create_document("order", order_doc)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return {"order_id": order_id, "status": "received", "subtotal": subtotal, "shipping": SHIPPING_FEE, "total": total}
+
+
+def _openapi():
+    """FastAPI's generated schema plus the models behind create_order's body"""
+    if app.openapi_schema is None:
+        schema = FastAPI.openapi(app)
+        schema.setdefault("components", {}).setdefault("schemas", {}).update(ORDER_BODY_COMPONENTS)
+    return app.openapi_schema
+
+
+app.openapi = _openapi
 
 
 if __name__ == "__main__":
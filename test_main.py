@@ -0,0 +1,199 @@
+import mongomock_motor
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+import main
+from main import app
+
+client = TestClient(app)
+
+CUSTOMER = {
+    "full_name": "Ada Lovelace",
+    "email": "ada@example.com",
+    "phone": "555-0100",
+    "address_line1": "1 Analytical Way",
+    "city": "London",
+    "state": "LDN",
+    "postal_code": "N1",
+    "country": "UK",
+}
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    db = mongomock_motor.AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(database, "db", db)
+    monkeypatch.setattr(main, "db", db)
+    return db
+
+
+@pytest.fixture
+def db_client(mock_db):
+    """Client against a mock database seeded with the sample products"""
+    with TestClient(app) as c:
+        # Seeding also clears the (process-wide) products cache
+        assert c.get("/api/products/sample-seed").json()["inserted"] == len(main.SAMPLES)
+        yield c
+
+
+def product_id(c, slug):
+    return c.get(f"/api/products/{slug}").json()["id"]
+
+
+def test_create_order_rejects_non_utf8_body():
+    response = client.post(
+        "/api/orders",
+        content=b"\xff\xfe",
+        headers={"Content-Type": "application/json"},
+    )
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["type"] == "json_invalid"
+    assert response.json()["detail"][0]["loc"] == ["body"]
+    assert "input" not in response.json()["detail"][0]
+
+
+def test_create_order_keeps_input_for_decodable_errors():
+    response = client.post("/api/orders", content=b"{bad", headers={"Content-Type": "application/json"})
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["input"] == "{bad"
+
+
+def test_create_order_reports_field_errors_under_body():
+    response = client.post("/api/orders", json={"items": [{"product_id": "x", "quantity": 0}]})
+    assert response.status_code == 422
+    errors = {tuple(err["loc"]): err for err in response.json()["detail"]}
+    assert errors[("body", "items", 0, "quantity")]["input"] == 0
+    locs = [list(loc) for loc in errors]
+    assert ["body", "customer"] in locs
+
+
+def test_openapi_refs_resolve():
+    spec = client.get("/openapi.json").json()
+
+    def resolve(ref):
+        node = spec
+        for part in ref.removeprefix("#/").split("/"):
+            node = node[part]
+        return node
+
+    def refs(node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == "$ref":
+                    yield value
+                else:
+                    yield from refs(value)
+        elif isinstance(node, list):
+            for item in node:
+                yield from refs(item)
+
+    body = spec["paths"]["/api/orders"]["post"]["requestBody"]["content"]["application/json"]["schema"]
+    assert resolve(body["$ref"])["title"] == "OrderPayload"
+    for ref in refs(spec):
+        resolve(ref)
+
+
+def test_create_order_prices_from_catalog(db_client, mock_db, monkeypatch):
+    monkeypatch.setattr(main, "SHIPPING_FEE", 5.0)
+    items = [
+        # Client-side prices are not part of the payload and are ignored
+        {"product_id": product_id(db_client, "precision-servo-mount"), "quantity": 2, "price": 0.01},
+        {"product_id": product_id(db_client, "pdb-12v"), "quantity": 1},
+    ]
+    response = db_client.post("/api/orders", json={"items": items, "customer": CUSTOMER})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["subtotal"] == 59.48
+    assert body["shipping"] == 5.0
+    assert body["total"] == 64.48
+
+    order = db_client.portal.call(mock_db.order.find_one, {})
+    assert [(i["title"], i["price"], i["quantity"]) for i in order["items"]] == [
+        ("Precision Servo Mount", 9.99, 2),
+        ("Robotics Power Distribution Board", 39.5, 1),
+    ]
+    assert order["total"] == 64.48
+    assert str(order["_id"]) == body["order_id"]
+
+
+def test_create_order_rejects_unknown_product(db_client):
+    items = [{"product_id": "a" * 24, "quantity": 1}]
+    response = db_client.post("/api/orders", json={"items": items, "customer": CUSTOMER})
+    assert response.status_code == 400
+    assert response.json()["detail"] == f"Unknown product: {'a' * 24}"
+
+
+def test_create_order_rejects_invalid_product_id(db_client):
+    items = [{"product_id": "not-an-object-id", "quantity": 1}]
+    response = db_client.post("/api/orders", json={"items": items, "customer": CUSTOMER})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid product id"
+
+
+def test_create_order_rejects_out_of_stock_product(db_client, mock_db):
+    db_client.portal.call(mock_db.product.update_one, {"slug": "pdb-12v"}, {"$set": {"in_stock": False}})
+    items = [{"product_id": product_id(db_client, "pdb-12v"), "quantity": 1}]
+    response = db_client.post("/api/orders", json={"items": items, "customer": CUSTOMER})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Out of stock: Robotics Power Distribution Board"
+    assert db_client.portal.call(mock_db.order.count_documents, {}) == 0
+
+
+def test_backfilled_search_text_matches_prefix_search(db_client, mock_db):
+    legacy = {"title": "Émetteur Module", "slug": "emetteur", "category": "electronics", "price": 5.0, "tags": ["RF"]}
+    db_client.portal.call(mock_db.product.insert_one, legacy)
+    db_client.portal.call(database.ensure_indexes)
+
+    stored = db_client.portal.call(mock_db.product.find_one, {"slug": "emetteur"})
+    assert stored["search_text"] == database._search_text(legacy) == ["émetteur module", "rf"]
+    for q in ("é", "ÉMET", "rf"):
+        slugs = [p["slug"] for p in db_client.get("/api/products", params={"q": q, "prefix": "true"}).json()["items"]]
+        assert slugs == ["emetteur"]
+
+
+def test_create_order_rejects_mismatched_subtotal(db_client):
+    items = [{"product_id": product_id(db_client, "precision-servo-mount"), "quantity": 2}]
+    response = db_client.post("/api/orders", json={"items": items, "customer": CUSTOMER, "subtotal": 19.97})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "subtotal mismatch"
+
+
+def test_create_order_accepts_matching_or_missing_subtotal(db_client):
+    items = [{"product_id": product_id(db_client, "precision-servo-mount"), "quantity": 2}]
+    for extra in ({"subtotal": 19.98}, {"subtotal": 19.985}, {}):
+        response = db_client.post("/api/orders", json={"items": items, "customer": CUSTOMER, **extra})
+        assert response.status_code == 200
+        assert response.json()["subtotal"] == 19.98
+
+
+def test_samples_are_read_only_and_seed_cleanly(db_client):
+    with pytest.raises(TypeError):
+        main.SAMPLES[0]["price"] = 0
+    product = db_client.get("/api/products/precision-servo-mount").json()
+    assert product["tags"] == ["mount", "3d print", "servo"]
+    assert product["specs"]["materials"] == ["PLA+"]
+
+
+def test_list_products_rejects_limit_above_cap(db_client):
+    assert db_client.get("/api/products", params={"limit": main.MAX_PAGE_SIZE + 1}).status_code == 422
+    assert db_client.get("/api/products", params={"limit": 0}).status_code == 422
+
+
+def test_list_products_pages_with_after_cursor(db_client):
+    seen = []
+    params = {"limit": 2}
+    while True:
+        body = db_client.get("/api/products", params=params).json()
+        seen.extend(p["slug"] for p in body["items"])
+        if body["next"] is None:
+            break
+        assert body["next"] == body["items"][-1]["id"]
+        params = {"limit": 2, "after": body["next"]}
+    assert seen == [s["slug"] for s in main.SAMPLES]
+
+
+def test_list_products_rejects_bad_cursor(db_client):
+    response = db_client.get("/api/products", params={"after": "not-a-cursor"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"